@@ -0,0 +1,169 @@
+import numpy as np
+import pandas as pd
+
+# Deduplicación entre lotes y ejecuciones.
+#
+# Cada fila se identifica con dos hashes de 64 bits:
+#   - key_hash: hash de la clave natural (payment_id, claim_id, ...)
+#   - row_hash: hash de la clave natural + contenido de la fila (sin columnas de
+#     control CDC; un borrado se representa con una marca fija de tombstone)
+# El índice persistido guarda, ordenado por key_hash, la última versión conocida
+# de cada clave (row_hash), la versión anterior a ella (prev_row_hash) y el lote
+# que la introdujo (batch_id). Cada lote nuevo se compara contra todo el historial
+# con búsqueda binaria sin volver a leer los datos ya cargados.
+# La probabilidad de colisión es despreciable (~n^2 / 2^65, ~3e-6 para 10M filas).
+
+# Clave natural de cada entidad cargada en Bronze
+DEDUP_KEYS = {
+    "clients": ["client_id"],
+    "crm_clients": ["client_id"],
+    "vehicles": ["vehicle_id"],
+    "policies": ["policy_id"],
+    "claims": ["claim_id"],
+    "payments": ["payment_id"],
+}
+
+# Columnas de control que no forman parte del contenido, de modo que una fila de un
+# delta CDC es igual a la misma fila de un snapshot o extracto plano
+DEDUP_EXCLUDE_COLUMNS = ["op", "op_seq", "batch_id", "op_ts"]
+
+# Marca que reemplaza al contenido de las filas borradas (op == 'D')
+TOMBSTONE_COLUMN = "_tombstone"
+
+# prev_row_hash = 0 indica que la clave no existía antes del lote que la introdujo
+UNKNOWN_HASH = np.uint64(0)
+
+INDEX_COLUMNS = ["key_hash", "row_hash", "prev_row_hash", "batch_id"]
+
+def hash_columns(df, columns):
+    # Se normaliza a texto y los enteros con decimales vacíos ("2010.0" -> "2010"),
+    # ya que una columna entera pasa a float cuando otro lote trae nulos. Las columnas
+    # se ordenan por nombre para que el orden del archivo no altere el hash.
+    normalized = df[sorted(columns)].astype("string").fillna("")
+    normalized = normalized.apply(lambda col: col.str.replace(r"^(-?\d+)\.0+$", r"\1", regex=True))
+    return pd.util.hash_pandas_object(normalized, index=False).to_numpy(dtype=np.uint64)
+
+def compute_row_hashes(df, key_cols):
+    content_cols = [c for c in df.columns if c not in DEDUP_EXCLUDE_COLUMNS]
+    key_hash, row_hash = hash_columns(df, key_cols), hash_columns(df, content_cols).copy()
+
+    # Un borrado es una versión nueva de la clave, independiente del contenido enviado
+    if "op" in df.columns:
+        deleted = (df["op"] == "D").to_numpy()
+        if deleted.any():
+            df_deleted = df.loc[deleted, key_cols].assign(**{TOMBSTONE_COLUMN: "deleted"})
+            row_hash[deleted] = hash_columns(df_deleted, key_cols + [TOMBSTONE_COLUMN])
+    return key_hash, row_hash
+
+def isin_sorted(values, sorted_array):
+    if len(sorted_array) == 0:
+        return np.zeros(len(values), dtype=bool)
+    positions = np.searchsorted(sorted_array, values)
+    positions = np.minimum(positions, len(sorted_array) - 1)
+    return sorted_array[positions] == values
+
+def empty_index():
+    return {
+        "key_hash": np.array([], dtype=np.uint64),
+        "row_hash": np.array([], dtype=np.uint64),
+        "prev_row_hash": np.array([], dtype=np.uint64),
+        "batch_id": np.array([], dtype=object),
+    }
+
+def index_from_dataframe(df_index):
+    if df_index is None:
+        return empty_index()
+    df_index = df_index.sort_values("key_hash")
+    return {
+        col: df_index[col].to_numpy(dtype=object if col == "batch_id" else np.uint64)
+        for col in INDEX_COLUMNS
+    }
+
+def index_to_dataframe(index):
+    return pd.DataFrame({col: index[col] for col in INDEX_COLUMNS})
+
+def lookup_baseline(index, key_hash, batch_id):
+    # Versión vigente de cada clave antes del lote actual. Si la última versión la
+    # escribió este mismo lote (reintento), se usa la anterior para que el
+    # resultado del lote sea siempre el mismo.
+    baseline = np.full(len(key_hash), UNKNOWN_HASH, dtype=np.uint64)
+    if len(index["key_hash"]) == 0:
+        return baseline
+    positions = np.minimum(np.searchsorted(index["key_hash"], key_hash), len(index["key_hash"]) - 1)
+    found = index["key_hash"][positions] == key_hash
+    same_batch = found & (index["batch_id"][positions] == batch_id)
+    baseline[found] = index["row_hash"][positions[found]]
+    baseline[same_batch] = index["prev_row_hash"][positions[same_batch]]
+    return baseline
+
+def deduplicate_batch(df, index, key_cols, batch_id, keep_all_versions=True, drop_history_duplicates=True):
+    # Clasifica cada fila del lote comparándola con la versión anterior de su clave
+    # (la fila previa del lote o, si es la primera, la vigente en el historial):
+    #   - duplicates_in_batch: igual a la versión previa dentro del lote
+    #   - duplicates_history: igual a la versión vigente en el historial
+    #   - conflicting_versions: clave conocida con contenido distinto (nueva versión)
+    #   - new_rows: clave nunca vista
+    # keep_all_versions=False (snapshots y extractos sin columna op) conserva solo la
+    # última fila de cada clave; las anteriores se informan como superseded_versions.
+    # drop_history_duplicates=False (snapshot completo) conserva las filas ya cargadas.
+    # Las filas sin clave natural no se pueden comparar: se conservan sin tocar el
+    # índice y se informan como null_key_rows.
+    null_key = df[key_cols].isna().any(axis=1).to_numpy()
+    key_hash, row_hash = compute_row_hashes(df[~null_key], key_cols)
+    baseline = lookup_baseline(index, key_hash, batch_id)
+
+    # Se ordena por clave (estable, respeta el orden del lote) para encadenar versiones
+    order = np.argsort(key_hash, kind="stable")
+    keys, rows, base = key_hash[order], row_hash[order], baseline[order]
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    last = np.ones(len(keys), dtype=bool)
+    last[:-1] = keys[:-1] != keys[1:]
+
+    previous = np.empty(len(keys), dtype=np.uint64)
+    previous[1:] = rows[:-1]
+    previous[first] = base[first]
+    known = ~first | (base != UNKNOWN_HASH)
+    duplicate = known & (rows == previous)
+
+    dup_in_batch = duplicate & ~first
+    dup_history = duplicate & first
+    if keep_all_versions:
+        keep_sorted = ~dup_in_batch
+        if drop_history_duplicates:
+            keep_sorted &= ~dup_history
+    else:
+        keep_sorted = last.copy()
+        if drop_history_duplicates:
+            keep_sorted &= ~((base != UNKNOWN_HASH) & (rows == base))
+
+    keep_keyed = np.empty(len(keys), dtype=bool)
+    keep_keyed[order] = keep_sorted
+    keep = null_key.copy()
+    keep[~null_key] = keep_keyed
+
+    # Nueva versión vigente para las claves cuyo último contenido cambió en este lote
+    final_keys, final_rows, final_base = keys[last], rows[last], base[last]
+    changed = final_rows != final_base
+    updated = {
+        "key_hash": final_keys[changed],
+        "row_hash": final_rows[changed],
+        "prev_row_hash": final_base[changed],
+        "batch_id": np.full(changed.sum(), batch_id, dtype=object),
+    }
+    unchanged = ~isin_sorted(index["key_hash"], updated["key_hash"])
+    new_index = {col: np.concatenate([index[col][unchanged], updated[col]]) for col in INDEX_COLUMNS}
+    index_order = np.argsort(new_index["key_hash"], kind="stable")
+    new_index = {col: values[index_order] for col, values in new_index.items()}
+
+    stats = {
+        "rows_in_batch": len(df),
+        "null_key_rows": int(null_key.sum()),
+        "new_rows": int((first & (base == UNKNOWN_HASH)).sum()),
+        "duplicates_in_batch": int(dup_in_batch.sum()),
+        "duplicates_history": int(dup_history.sum()),
+        "conflicting_versions": int((known & ~duplicate).sum()),
+        "superseded_versions": 0 if keep_all_versions else int((~last & ~duplicate).sum()),
+        "rows_written": int(keep.sum()),
+    }
+    return df[keep].reset_index(drop=True), new_index, stats
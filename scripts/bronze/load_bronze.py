@@ -1,11 +1,16 @@
 import pandas as pd
 import os 
+import argparse
+from io import BytesIO
 from pathlib import Path
 from datetime import datetime
 import logging
 import pyarrow 
 from botocore.exceptions import ClientError
 from scripts.config.aws_credentials import get_aws_credentials
+from scripts.bronze.deduplication import (
+    DEDUP_KEYS, deduplicate_batch, index_from_dataframe, index_to_dataframe
+)
 from dotenv import load_dotenv
 
 # Configuración del logger
@@ -70,28 +75,109 @@ def save_to_s3(df, bucket, key, logger: logging.Logger):
         logger.error(f"Error al guardar en S3: {str(e)}")
         raise
 
-def load_bronze_data(s3_bucket):
+def read_from_s3_if_exists(bucket, key, logger: logging.Logger):
     
-    logger.info("Iniciando carga de datos en la capa Bronze")
+    try:
+        aws_session = get_aws_credentials()
+        s3_client = aws_session.client('s3')
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        return pd.read_parquet(BytesIO(response['Body'].read()))
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+            logger.info(f"No existe s3://{bucket}/{key}, se creará desde cero")
+            return None
+        logger.error(f"Error de AWS S3: {str(e)}")
+        raise
+
+# Índice persistido de hashes y reporte de deduplicación por carga
+DEDUP_INDEX_PREFIX = "bronze/_dedup_index"
+
+def deduplicate_with_history(df, s3_bucket, file_name, batch_id, logger: logging.Logger, drop_history_duplicates=True):
+    
+    index_key = f"{DEDUP_INDEX_PREFIX}/{file_name}.parquet"
+    index = index_from_dataframe(read_from_s3_if_exists(s3_bucket, index_key, logger))
+
+    # Los deltas CDC (columna op) conservan todas sus versiones en orden; los snapshots
+    # y extractos planos solo la última versión de cada clave natural
+    df_unique, new_index, stats = deduplicate_batch(
+        df, index, DEDUP_KEYS[file_name], batch_id,
+        keep_all_versions="op" in df.columns,
+        drop_history_duplicates=drop_history_duplicates
+    )
+    logger.info(
+        f"Deduplicación {file_name}: {stats['rows_in_batch']} filas, {stats['new_rows']} nuevas, "
+        f"{stats['duplicates_in_batch']} duplicadas en el lote, {stats['duplicates_history']} ya cargadas, "
+        f"{stats['conflicting_versions']} versiones en conflicto, {stats['superseded_versions']} reemplazadas "
+        f"por una versión posterior, {stats['null_key_rows']} sin clave natural, {stats['rows_written']} escritas"
+    )
+
+    def commit_index():
+        # Se llama después de guardar los datos. El índice guarda qué lote escribió cada
+        # versión, así que reintentar un lote (falle antes o después de este paso)
+        # reescribe exactamente las mismas filas en la misma ruta
+        save_to_s3(index_to_dataframe(new_index), s3_bucket, index_key, logger)
+
+        report_key = f"{DEDUP_INDEX_PREFIX}/load_report.parquet"
+        df_report = read_from_s3_if_exists(s3_bucket, report_key, logger)
+        df_row = pd.DataFrame([{"load_ts": datetime.now(), "batch_id": batch_id, "entity": file_name, **stats}])
+        df_report = df_row if df_report is None else pd.concat([df_report, df_row], ignore_index=True)
+        save_to_s3(df_report, s3_bucket, report_key, logger)
+
+    return df_unique, commit_index
+
+def load_bronze_data(s3_bucket, source_dir="data_sources", batch_id=None):
+    
+    # Sin batch_id: snapshot completo que reemplaza las tablas Bronze.
+    # Con batch_id: lote incremental (p. ej. un delta CDC); solo se escriben las filas
+    # no cargadas previamente en bronze/batches/<batch_id>/. La ruta es determinística,
+    # por lo que reintentar el mismo lote sobrescribe en lugar de duplicar. La capa
+    # Silver todavía no lee bronze/batches/: por ahora el índice y el reporte de
+    # deduplicación preparan una futura carga incremental de Silver.
+    incremental = batch_id is not None
+    snapshot_id = f"snapshot_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    logger.info(f"Iniciando carga de datos en la capa Bronze ({'lote ' + batch_id if incremental else 'snapshot'})")
 
     # Mapeo de archivos y sus rutas en S3
     files_to_process = {
-        "clients": {"source": "data_sources/clients.csv", "destination": "bronze/erp_clients.parquet"},
-        "vehicles": {"source": "data_sources/vehicles.csv", "destination": "bronze/erp_vehicles.parquet"},
-        "policies": {"source": "data_sources/policies.csv", "destination": "bronze/erp_policies.parquet"},
-        "claims": {"source": "data_sources/claims.csv", "destination": "bronze/erp_claims.parquet"},
-        "payments": {"source": "data_sources/payments.csv", "destination": "bronze/erp_payments.parquet"},
-        "crm_clients": {"source": "data_sources/crm_clients.csv", "destination": "bronze/crm_clients.parquet"}
+        "clients": {"source": f"{source_dir}/clients.csv", "destination": "erp_clients.parquet"},
+        "vehicles": {"source": f"{source_dir}/vehicles.csv", "destination": "erp_vehicles.parquet"},
+        "policies": {"source": f"{source_dir}/policies.csv", "destination": "erp_policies.parquet"},
+        "claims": {"source": f"{source_dir}/claims.csv", "destination": "erp_claims.parquet"},
+        "payments": {"source": f"{source_dir}/payments.csv", "destination": "erp_payments.parquet"},
+        "crm_clients": {"source": f"{source_dir}/crm_clients.csv", "destination": "crm_clients.parquet"}
     }
 
+    # Entidades de este lote ya registradas en el reporte (carga completa previa)
+    loaded_entities = set()
+    if incremental:
+        df_report = read_from_s3_if_exists(s3_bucket, f"{DEDUP_INDEX_PREFIX}/load_report.parquet", logger)
+        if df_report is not None:
+            loaded_entities = set(df_report.loc[df_report["batch_id"] == batch_id, "entity"])
+
     try:
         for file_name, paths in files_to_process.items():
             try:
+                if incremental and not Path(paths["source"]).exists():
+                    logger.info(f"Lote {batch_id} sin archivo para {file_name}, se omite")
+                    continue
+
+                if file_name in loaded_entities:
+                    logger.info(f"Lote {batch_id} ya cargado para {file_name}, se omite")
+                    continue
+
                 # Leer CSV
                 df = read_csv_file(paths["source"], logger)
+
+                # Deduplicar contra el historial (en snapshots se conserva la última versión de cada clave)
+                df, commit_index = deduplicate_with_history(
+                    df, s3_bucket, file_name, batch_id or snapshot_id, logger,
+                    drop_history_duplicates=incremental
+                )
                 
                 # Guardar en S3 como Parquet
-                save_to_s3(df, s3_bucket, paths["destination"], logger)
+                destination = f"bronze/batches/{batch_id}/{paths['destination']}" if incremental else f"bronze/{paths['destination']}"
+                save_to_s3(df, s3_bucket, destination, logger)
+                commit_index()
                 
                 logger.info(f"Procesamiento completo para {file_name}")
                 
@@ -108,12 +194,17 @@ def load_bronze_data(s3_bucket):
 
 if __name__ == "__main__":
     try:
+        parser = argparse.ArgumentParser(description="Carga de archivos CSV a la capa Bronze")
+        parser.add_argument("--source-dir", default="data_sources", help="Carpeta con los CSV a cargar")
+        parser.add_argument("--batch-id", default=None, help="Identificador de lote incremental (p. ej. delta_0001)")
+        args = parser.parse_args()
+
         logger = setup_logger()
         S3_BUCKET = os.getenv("S3_BUCKET")
         logger.info(f"Iniciando carga de datos en la capa Bronze en el bucket {S3_BUCKET}")
         
         # Ejecutar la carga de datos
-        load_bronze_data(S3_BUCKET)
+        load_bronze_data(S3_BUCKET, args.source_dir, args.batch_id)
         
     except Exception as e:
         logging.error(f"Error en la ejecución principal: {str(e)}")
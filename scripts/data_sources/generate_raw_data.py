@@ -1,11 +1,23 @@
 import pandas as pd
 import random
 import uuid
+import argparse
 from faker import Faker
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
 
+# Columnas de control agregadas a cada registro de un archivo delta CDC
+CDC_COLUMNS = ["op", "op_seq", "batch_id", "op_ts"]
+
+# Clave natural de cada entidad incluida en los deltas CDC
+CDC_KEYS = {
+    "policies": "policy_id",
+    "claims": "claim_id",
+    "payments": "payment_id",
+    "crm_clients": "client_id",
+}
+
 # Configuración del logger
 def setup_logger():
     log_dir = Path("logs")
@@ -21,12 +33,16 @@ def setup_logger():
     )
     return logging.getLogger(__name__)
 
+def new_id():
+    # Se usa random (y no uuid4) para que los IDs sean reproducibles con --seed
+    return str(uuid.UUID(int=random.getrandbits(128)))[:8]
+
 def generate_clients(n):
     fake = Faker()
     clients = []
     logger.info(f"Iniciando generación de {n} registros de clientes")
     for _ in range(n):
-        client_id = str(uuid.uuid4())[:8]
+        client_id = new_id()
         name = fake.name()
         email = fake.email() if random.random() > 0.1 else None
         phone = fake.phone_number() if random.random() > 0.1 else ""
@@ -38,7 +54,7 @@ def generate_crm_clients(df_clients):
     fake = Faker()
     crm_clients = []
     logger.info(f"Iniciando generación de registros de clientes de CRM")
-    base_clients = df_clients.sample(frac=0.7).copy()
+    base_clients = df_clients.sample(frac=0.7, random_state=random.randrange(2**32)).copy()
     for _, row in base_clients.iterrows():
         name = row['name'] if random.random() > 0.3 else row['name'].upper()
         email = row['email'] if random.random() > 0.2 else None
@@ -71,7 +87,7 @@ def generate_vehicles(n, client_ids):
     vehicles = []
     logger.info(f"Iniciando generación de {n} registros de vehículos")
     for _ in range(n):
-        vehicle_id = str(uuid.uuid4())[:8]
+        vehicle_id = new_id()
         client_id = random.choice(client_ids) if random.random() > 0.05 else None
         brand = random.choice(vehicle_brands)
         model = random.choice(vehicle_models)
@@ -86,7 +102,7 @@ def generate_policies(n, client_ids, vehicle_ids):
     policies = []
     logger.info(f"Iniciando generación de {n} registros de pólizas")
     for _ in range(n):
-        policy_id = str(uuid.uuid4())[:8]
+        policy_id = new_id()
         client_id = random.choice(client_ids) if random.random() > 0.05 else None
         vehicle_id = random.choice(vehicle_ids) if random.random() > 0.05 else None
         coverage = random.choice(coverage_types)
@@ -95,36 +111,44 @@ def generate_policies(n, client_ids, vehicle_ids):
         policies.append([policy_id, client_id, vehicle_id, coverage, status, premium])
     return pd.DataFrame(policies, columns=["policy_id", "client_id", "vehicle_id", "coverage", "status", "premium"])
 
-def generate_claims(n, policy_ids):
+def random_date(fake, date_range):
+    # Sin rango fijo se usa la década actual (cambia según el día de ejecución)
+    if date_range is None:
+        return fake.date_this_decade()
+    return fake.date_between_dates(date_start=date_range[0], date_end=date_range[1])
+
+def generate_claims(n, policy_ids, date_range=None):
     fake = Faker()
     claim_types = ["Colisión", "Robo", "Daños por clima", "Incendio", "Otros"]
     claims = []
     logger.info(f"Iniciando generación de {n} registros de reclamaciones")
     for _ in range(n):
-        claim_id = str(uuid.uuid4())[:8]
+        claim_id = new_id()
         policy_id = random.choice(policy_ids) if random.random() > 0.1 else None
-        claim_date = fake.date_this_decade() if random.random() > 0.05 else "2030-01-01"
+        claim_date = random_date(fake, date_range) if random.random() > 0.05 else "2030-01-01"
         claim_type = random.choice(claim_types)
         amount = round(random.uniform(100, 20000), 2)
         claims.append([claim_id, policy_id, claim_date, claim_type, amount])
     return pd.DataFrame(claims, columns=["claim_id", "policy_id", "claim_date", "claim_type", "amount"])
 
-def generate_payments(n, policy_ids):
+def generate_payments(n, policy_ids, date_range=None):
     fake = Faker()
     payments = []
     logger.info(f"Iniciando generación de {n} registros de pagos")
     for _ in range(n):
-        payment_id = str(uuid.uuid4())[:8]
+        payment_id = new_id()
         policy_id = random.choice(policy_ids) if random.random() > 0.1 else None
         amount = round(random.uniform(-100, 3000), 2)
-        payment_date = fake.date_this_decade()
+        payment_date = random_date(fake, date_range)
         payments.append([payment_id, policy_id, amount, payment_date])
     return pd.DataFrame(payments, columns=["payment_id", "policy_id", "amount", "payment_date"])
 
-if __name__ == "__main__":
-    logger = setup_logger()
-    logger.info("Iniciando generación de datos relacionados")
+def history_date_range(start_date, years=3):
+    # Rango fijo de historia que termina el día anterior a start_date, para que una
+    # misma semilla genere los mismos datos cualquier día y los deltas sean posteriores
+    return start_date - timedelta(days=365 * years), start_date - timedelta(days=1)
 
+def generate_snapshot(date_range=None):
     df_clients = generate_clients(5000)
     client_ids = df_clients["client_id"].tolist()
 
@@ -136,16 +160,165 @@ if __name__ == "__main__":
     df_policies = generate_policies(5000, client_ids, vehicle_ids)
     policy_ids = df_policies["policy_id"].tolist()
 
-    df_claims = generate_claims(2500, policy_ids)
-    df_payments = generate_payments(5000, policy_ids)
+    df_claims = generate_claims(2500, policy_ids, date_range)
+    df_payments = generate_payments(5000, policy_ids, date_range)
+
+    return {
+        "clients": df_clients,
+        "crm_clients": df_crm_clients,
+        "vehicles": df_vehicles,
+        "policies": df_policies,
+        "claims": df_claims,
+        "payments": df_payments,
+    }
+
+def save_csv_files(dataframes, output_dir):
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    for name, df in dataframes.items():
+        df.to_csv(f"{output_dir}/{name}.csv", index=False)
+
+# Modo CDC: snapshot base + N deltas ordenados con operaciones I/U/D
+
+def sample_rows(df, rate):
+    # Selecciona ~rate * len(df) filas de forma reproducible
+    n = min(len(df), int(round(len(df) * rate)))
+    return random.sample(df.index.tolist(), n) if n > 0 else []
+
+def generate_cdc_batch(state, batch_id, batch_date, rates, op_seq):
+    logger.info(f"Generando delta CDC {batch_id} para la fecha {batch_date}")
+    changes = {name: [] for name in CDC_KEYS}
+    batch_start = datetime.combine(batch_date, datetime.min.time())
+    policy_ids = state["policies"].index.tolist()
+
+    def emit(entity, op, row):
+        nonlocal op_seq
+        op_seq += 1
+        batch_ops = sum(len(records) for records in changes.values())
+        op_ts = batch_start + timedelta(seconds=batch_ops)
+        record = {CDC_KEYS[entity]: row.name, **row.to_dict()}
+        record.update({"op": op, "op_seq": op_seq, "batch_id": batch_id, "op_ts": op_ts.isoformat(sep=" ")})
+        changes[entity].append(record)
+
+    # 1. Cambios de estado de pólizas (Activa -> Vencida / Cancelada)
+    df_active = state["policies"][state["policies"]["status"] == "Activa"]
+    for policy_id in sample_rows(df_active, rates["policy_status_rate"]):
+        state["policies"].at[policy_id, "status"] = random.choice(["Vencida", "Cancelada"])
+        emit("policies", "U", state["policies"].loc[policy_id])
+
+    # 2. Nuevos reclamos del día y revisiones de montos de reclamos existentes
+    for claim_id in sample_rows(state["claims"], rates["claim_update_rate"]):
+        state["claims"].at[claim_id, "amount"] = round(random.uniform(100, 20000), 2)
+        emit("claims", "U", state["claims"].loc[claim_id])
+
+    df_new_claims = generate_claims(rates["new_claims"], policy_ids, (batch_date, batch_date))
+    valid_dates = df_new_claims["claim_date"] != "2030-01-01"
+    df_new_claims.loc[valid_dates, "claim_date"] = batch_date
+    df_new_claims = df_new_claims.set_index("claim_id")
+    state["claims"] = pd.concat([state["claims"], df_new_claims])
+    for _, row in df_new_claims.iterrows():
+        emit("claims", "I", row)
+
+    # 3. Nuevos pagos del día, correcciones y reversos (borrados)
+    for payment_id in sample_rows(state["payments"], rates["payment_update_rate"]):
+        state["payments"].at[payment_id, "amount"] = round(random.uniform(-100, 3000), 2)
+        emit("payments", "U", state["payments"].loc[payment_id])
+
+    for payment_id in sample_rows(state["payments"], rates["payment_delete_rate"]):
+        emit("payments", "D", state["payments"].loc[payment_id])
+        state["payments"] = state["payments"].drop(payment_id)
+
+    df_new_payments = generate_payments(rates["new_payments"], policy_ids, (batch_date, batch_date))
+    df_new_payments["payment_date"] = batch_date
+    df_new_payments = df_new_payments.set_index("payment_id")
+    state["payments"] = pd.concat([state["payments"], df_new_payments])
+    for _, row in df_new_payments.iterrows():
+        emit("payments", "I", row)
+
+    # 4. Actualizaciones y bajas de atributos CRM
+    for client_id in sample_rows(state["crm_clients"], rates["crm_update_rate"]):
+        state["crm_clients"].at[client_id, "client_type"] = random.choice(["gold", "silver", "bronze"])
+        state["crm_clients"].at[client_id, "risk_level"] = random.choice(["low", "medium", "high"])
+        state["crm_clients"].at[client_id, "marketing_opt_in"] = random.choice([True, False])
+        emit("crm_clients", "U", state["crm_clients"].loc[client_id])
+
+    for client_id in sample_rows(state["crm_clients"], rates["crm_delete_rate"]):
+        emit("crm_clients", "D", state["crm_clients"].loc[client_id])
+        state["crm_clients"] = state["crm_clients"].drop(client_id)
+
+    deltas = {}
+    for entity, key in CDC_KEYS.items():
+        columns = [key] + state[entity].columns.tolist() + CDC_COLUMNS
+        deltas[entity] = pd.DataFrame(changes[entity], columns=columns)
+        logger.info(f"Delta {batch_id} - {entity}: {len(deltas[entity])} operaciones")
+    return deltas, op_seq
+
+def generate_cdc(output_dir, num_deltas, start_date, rates):
+    logger.info(f"Iniciando generación CDC: snapshot base + {num_deltas} deltas")
+    snapshot = generate_snapshot(history_date_range(start_date))
+    save_csv_files(snapshot, f"{output_dir}/base")
+
+    # Estado vivo de cada entidad, indexado por su clave natural
+    state = {entity: snapshot[entity].set_index(key) for entity, key in CDC_KEYS.items()}
+
+    op_seq = 0
+    for i in range(1, num_deltas + 1):
+        batch_id = f"delta_{i:04d}"
+        batch_date = start_date + timedelta(days=i - 1)
+        deltas, op_seq = generate_cdc_batch(state, batch_id, batch_date, rates, op_seq)
+        save_csv_files(deltas, f"{output_dir}/{batch_id}")
+
+    logger.info(f"Archivos CDC generados correctamente en {output_dir} ({op_seq} operaciones)")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generador de datos crudos de seguros vehiculares")
+    parser.add_argument("--mode", choices=["snapshot", "cdc"], default="snapshot")
+    parser.add_argument("--seed", type=int, default=None, help="Semilla para generar datos reproducibles")
+    parser.add_argument("--output-dir", default=None, help="Por defecto data_sources (snapshot) o data_sources/cdc (cdc)")
+    parser.add_argument("--deltas", type=int, default=7, help="Cantidad de deltas CDC a generar")
+    parser.add_argument("--start-date", type=lambda x: datetime.strptime(x, "%Y-%m-%d").date(),
+                        default=datetime(2024, 1, 1).date(), help="Fecha del primer delta (YYYY-MM-DD); con semilla o en modo cdc el "
+                             "snapshot cubre los 3 años anteriores")
+    parser.add_argument("--new-payments", type=int, default=200, help="Pagos nuevos por delta")
+    parser.add_argument("--new-claims", type=int, default=100, help="Reclamos nuevos por delta")
+    parser.add_argument("--policy-status-rate", type=float, default=0.02,
+                        help="Fracción de pólizas activas que vencen o se cancelan por delta")
+    parser.add_argument("--claim-update-rate", type=float, default=0.005,
+                        help="Fracción de reclamos con revisión de monto por delta")
+    parser.add_argument("--payment-update-rate", type=float, default=0.002,
+                        help="Fracción de pagos corregidos por delta")
+    parser.add_argument("--payment-delete-rate", type=float, default=0.001,
+                        help="Fracción de pagos reversados (borrados) por delta")
+    parser.add_argument("--crm-update-rate", type=float, default=0.01,
+                        help="Fracción de clientes CRM con atributos actualizados por delta")
+    parser.add_argument("--crm-delete-rate", type=float, default=0.002,
+                        help="Fracción de clientes CRM eliminados por delta")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    logger = setup_logger()
 
-    # Guardar archivos en la carpeta data_sources
-    Path("data_sources").mkdir(exist_ok=True)
-    df_clients.to_csv("data_sources/clients.csv", index=False)
-    df_crm_clients.to_csv("data_sources/crm_clients.csv", index=False)
-    df_vehicles.to_csv("data_sources/vehicles.csv", index=False)
-    df_policies.to_csv("data_sources/policies.csv", index=False)
-    df_claims.to_csv("data_sources/claims.csv", index=False)
-    df_payments.to_csv("data_sources/payments.csv", index=False)
+    if args.seed is not None:
+        random.seed(args.seed)
+        Faker.seed(args.seed)
+        logger.info(f"Semilla utilizada: {args.seed}")
 
-    logger.info("Archivos CSV generados correctamente en la carpeta data_sources.")
+    if args.mode == "cdc":
+        rates = {
+            "new_payments": args.new_payments,
+            "new_claims": args.new_claims,
+            "policy_status_rate": args.policy_status_rate,
+            "claim_update_rate": args.claim_update_rate,
+            "payment_update_rate": args.payment_update_rate,
+            "payment_delete_rate": args.payment_delete_rate,
+            "crm_update_rate": args.crm_update_rate,
+            "crm_delete_rate": args.crm_delete_rate,
+        }
+        generate_cdc(args.output_dir or "data_sources/cdc", args.deltas, args.start_date, rates)
+    else:
+        logger.info("Iniciando generación de datos relacionados")
+        output_dir = args.output_dir or "data_sources"
+        # Con semilla se usa un rango de fechas fijo para que el resultado sea repetible
+        date_range = history_date_range(args.start_date) if args.seed is not None else None
+        save_csv_files(generate_snapshot(date_range), output_dir)
+        logger.info(f"Archivos CSV generados correctamente en la carpeta {output_dir}.")
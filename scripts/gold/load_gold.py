@@ -6,7 +6,9 @@ from datetime import datetime
 from pathlib import Path
 import logging
 from dotenv import load_dotenv
+from botocore.exceptions import ClientError
 from scripts.config.aws_credentials import get_aws_credentials
+from scripts.gold.sketches import HyperLogLog, TDigest, merge_hll, merge_tdigests
 
 # Logger
 
@@ -46,6 +48,62 @@ def save_parquet_to_s3(df, bucket, key, session, logger):
         logger.error(f"Error al guardar {key}: {e}")
         raise
 
+def read_optional_parquet_from_s3(bucket, key, session, logger):
+    # Devuelve None si la tabla aún no existe (primera ejecución)
+    try:
+        logger.info(f"Leyendo s3://{bucket}/{key}")
+        s3 = session.client('s3')
+        response = s3.get_object(Bucket=bucket, Key=key)
+        return pd.read_parquet(BytesIO(response['Body'].read()))
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+            logger.info(f"No existe s3://{bucket}/{key}, se creará desde cero")
+            return None
+        logger.error(f"Error al leer {key}: {e}")
+        raise
+
+# Las claves de origen unidas a cada partición se guardan en la misma tabla
+# (columna source_batches, separadas por ';'), de modo que el registro se escribe
+# junto con los sketches y un lote ya unido no se vuelve a sumar
+def sketch_batch_already_merged(df_existing, source_key):
+    if df_existing is None or 'source_batches' not in df_existing.columns:
+        return False
+    return df_existing['source_batches'].fillna('').str.split(';').apply(lambda keys: source_key in keys).any()
+
+def combine_source_batches(values):
+    keys = {key for value in values if isinstance(value, str) for key in value.split(';') if key}
+    return ';'.join(sorted(keys))
+
+def combine_sketch_partitions(df_existing, df_new, partition_cols, sketch_col, merge_fn, merge_existing, logger):
+    # merge_existing=False: las particiones recalculadas reemplazan a las existentes
+    # merge_existing=True: df_new proviene de un lote incremental y se une con el estado previo
+    if df_existing is None or df_existing.empty:
+        return df_new
+
+    if not merge_existing:
+        new_keys = df_new.set_index(partition_cols).index
+        keep = ~df_existing.set_index(partition_cols).index.isin(new_keys)
+        logger.info(f"Particiones conservadas sin cambios: {keep.sum()}")
+
+        # Se conservan las claves ya unidas a las particiones reemplazadas para que
+        # un lote incremental previo no vuelva a sumarse tras un recálculo completo
+        df_previous = df_existing.loc[~keep, partition_cols + ['source_batches']].rename(
+            columns={'source_batches': 'previous_batches'}
+        )
+        df_new = df_new.merge(df_previous, on=partition_cols, how='left')
+        df_new['source_batches'] = df_new[['source_batches', 'previous_batches']].apply(combine_source_batches, axis=1)
+        df_new = df_new.drop(columns=['previous_batches'])
+        return pd.concat([df_existing[keep], df_new], ignore_index=True)
+
+    df_all = pd.concat([df_existing, df_new], ignore_index=True)
+    df_merged = df_all.groupby(partition_cols, dropna=False).agg(
+        **{sketch_col: (sketch_col, lambda x: merge_fn(x).to_bytes())},
+        num_rows=('num_rows', 'sum'),
+        source_batches=('source_batches', combine_source_batches)
+    ).reset_index()
+    logger.info(f"Particiones unidas con el estado previo: {len(df_merged)}")
+    return df_merged
+
 # Crear dimension clientes
 def create_dim_clients(bucket):
     logger = setup_logger()
@@ -139,6 +197,73 @@ def create_fact_client_summary(bucket):
     logger.info(f"Resumen creado: {len(df_summary)} clientes")
     save_parquet_to_s3(df_summary, bucket, "gold/fact_client_summary.parquet", aws_session, logger)
 
+# Sketch HLL de clientes activos (con pagos) por mes
+def create_sketch_active_clients_monthly(bucket, payments_key="silver/erp_payments.parquet", merge_existing=False):
+    logger = setup_logger()
+    load_dotenv()
+    aws_session = get_aws_credentials()
+    target_key = "gold/sketch_active_clients_monthly.parquet"
+
+    df_existing = read_optional_parquet_from_s3(bucket, target_key, aws_session, logger)
+    if merge_existing and sketch_batch_already_merged(df_existing, payments_key):
+        logger.info(f"{payments_key} ya fue unido a {target_key}, se omite")
+        return
+
+    df_policies = read_parquet_from_s3(bucket, "silver/erp_policies.parquet", aws_session, logger)
+    df_payments = read_parquet_from_s3(bucket, payments_key, aws_session, logger)
+
+    df_policies_min = df_policies[['policy_id', 'client_id']].drop_duplicates()
+    df_payments = df_payments.merge(df_policies_min, on='policy_id', how='inner')
+    df_payments['month'] = pd.to_datetime(df_payments['payment_date']).dt.strftime('%Y-%m')
+    df_payments = df_payments.dropna(subset=['month', 'client_id'])
+
+    df_sketch = df_payments.groupby('month').agg(
+        hll_clients=('client_id', lambda x: HyperLogLog().update(x).to_bytes()),
+        num_rows=('payment_id', 'count')
+    ).reset_index()
+    df_sketch['source_batches'] = payments_key
+
+    df_sketch = combine_sketch_partitions(
+        df_existing, df_sketch, ['month'], 'hll_clients', merge_hll, merge_existing, logger
+    ).sort_values('month')
+
+    logger.info(f"Sketch de clientes activos creado: {len(df_sketch)} meses")
+    save_parquet_to_s3(df_sketch, bucket, target_key, aws_session, logger)
+
+# Sketch t-digest de montos de reclamos por mes, tipo de reclamo y cobertura
+def create_sketch_claim_amounts(bucket, claims_key="silver/erp_claims.parquet", merge_existing=False):
+    logger = setup_logger()
+    load_dotenv()
+    aws_session = get_aws_credentials()
+    target_key = "gold/sketch_claim_amounts.parquet"
+    partition_cols = ['month', 'claim_type', 'coverage']
+
+    df_existing = read_optional_parquet_from_s3(bucket, target_key, aws_session, logger)
+    if merge_existing and sketch_batch_already_merged(df_existing, claims_key):
+        logger.info(f"{claims_key} ya fue unido a {target_key}, se omite")
+        return
+
+    df_policies = read_parquet_from_s3(bucket, "silver/erp_policies.parquet", aws_session, logger)
+    df_claims = read_parquet_from_s3(bucket, claims_key, aws_session, logger)
+
+    df_policies_min = df_policies[['policy_id', 'coverage']].drop_duplicates(subset=['policy_id'])
+    df_claims = df_claims.merge(df_policies_min, on='policy_id', how='inner')
+    df_claims['month'] = pd.to_datetime(df_claims['claim_date']).dt.strftime('%Y-%m')
+    df_claims = df_claims.dropna(subset=['month', 'amount'])
+
+    df_sketch = df_claims.groupby(partition_cols, dropna=False).agg(
+        tdigest_amount=('amount', lambda x: TDigest().update(x).to_bytes()),
+        num_rows=('claim_id', 'count')
+    ).reset_index()
+    df_sketch['source_batches'] = claims_key
+
+    df_sketch = combine_sketch_partitions(
+        df_existing, df_sketch, partition_cols, 'tdigest_amount', merge_tdigests, merge_existing, logger
+    ).sort_values(partition_cols)
+
+    logger.info(f"Sketch de montos de reclamos creado: {len(df_sketch)} particiones")
+    save_parquet_to_s3(df_sketch, bucket, target_key, aws_session, logger)
+
 if __name__ == "__main__":
     try:
         S3_BUCKET = os.getenv("S3_BUCKET")
@@ -148,6 +273,10 @@ if __name__ == "__main__":
         create_dim_vehicles(S3_BUCKET)
         
         create_fact_client_summary(S3_BUCKET)
+
+        create_sketch_active_clients_monthly(S3_BUCKET)
+
+        create_sketch_claim_amounts(S3_BUCKET)
         
     except Exception as e:
         logging.error(f"Error en ejecución principal: {str(e)}")